@@ -237,18 +237,27 @@ def _beta_divergence(X, W, H, beta, square_root=False):
 def _special_dot_X(W, H, X, out=None):
     """Computes np.dot(W, H) in a special way:
 
-    - If X is sparse, np.dot(W, H) is computed only where X is non zero,
-    and a sparse matrix is returned, with the same sparsity as X.
+    - If X is sparse, np.dot(W, H) is computed only on the stored entries of
+    X, and a sparse matrix is returned, with the same sparsity as X. For CSR
+    and CSC matrices, the format, indices and indptr of X are kept, so that
+    the data of both matrices are aligned.
     - If X is masked, np.dot(W, H) is computed entirely, and a masked array is
     returned, with the same mask as X.
     - If X is dense, np.dot(W, H) is computed entirely, and returned as a dense
     array.
     """
     if sp.issparse(X):
-        ii, jj = X.nonzero()
-        dot_vals = np.multiply(W[ii, :], H.T[jj, :]).sum(axis=1)
-        WH = sp.coo_matrix((dot_vals, (ii, jj)), shape=X.shape)
-        return WH.tocsr()
+        if X.format not in ('csr', 'csc'):
+            X = X.tocsr()
+        # expand the compressed axis of X, avoiding a COO round trip
+        major = np.repeat(np.arange(len(X.indptr) - 1), np.diff(X.indptr))
+        if X.format == 'csr':
+            ii, jj = major, X.indices
+        else:
+            ii, jj = X.indices, major
+        dot_vals = np.einsum('ij,ij->i', W[ii, :], H.T[jj, :])
+        return X.__class__((dot_vals, X.indices.copy(), X.indptr.copy()),
+                           shape=X.shape)
     elif isinstance(X, np.ma.masked_array):
         WH = np.ma.masked_array(np.dot(W, H, out=out), mask=X.mask)
         WH._sharedmask = False
@@ -1,6 +1,11 @@
+from itertools import chain
+
 import numpy as np
 import scipy.sparse as sp
 
+# number of values checked at once by check_non_negative (512 KiB of float64)
+BLOCK_SIZE = 65536
+
 
 def check_non_negative(X, whom, accept_nan=False):
     """
@@ -17,21 +22,35 @@ def check_non_negative(X, whom, accept_nan=False):
     accept_nan : boolean
         If True, NaN values are accepted in X.
     """
-    # avoid X.min() on sparse matrix since it also sorts the indices
+    # avoid X.min() on sparse matrix since it also sorts the indices, and
+    # read LIL and DOK values directly since only the values are checked
     if sp.issparse(X):
-        if X.format in ['lil', 'dok']:
-            X = X.tocsr()
-        if X.data.size == 0:
-            X = np.arange(1)
+        if X.format == 'lil':
+            X = np.fromiter(chain.from_iterable(X.data), dtype=X.dtype)
+        elif X.format == 'dok':
+            X = np.fromiter(X.values(), dtype=X.dtype, count=X.nnz)
         else:
             X = X.data
 
-    if accept_nan:
-        X_min = np.nanmin(X)
-    else:
-        X_min = np.min(X)
-        if np.isnan(X_min):
-            raise ValueError("NaN values in data passed to %s" % whom)
+    # nothing to check, e.g. a sparse matrix without stored values
+    if np.size(X) == 0:
+        return
+
+    # scan L2-sized blocks to stop at the first invalid one; ravel with
+    # order='K' is a view for both C and F contiguous arrays
+    X = np.ravel(X, order='K')
+    for start in range(0, X.size, BLOCK_SIZE):
+        block = X[start:start + BLOCK_SIZE]
+        # a single reduction per block: np.min propagates NaN, while
+        # np.fmin ignores it without warning on all-NaN blocks
+        if accept_nan:
+            block_min = np.fmin.reduce(block)
+        else:
+            block_min = np.min(block)
+            if np.isnan(block_min):
+                raise ValueError("NaN values in data passed to %s" % whom)
 
-    if X_min < 0:
-        raise ValueError("Negative values in data passed to %s" % whom)
+        # compare the minimum rather than testing sign bits, so that
+        # explicitly stored -0. values are accepted
+        if block_min < 0:
+            raise ValueError("Negative values in data passed to %s" % whom)
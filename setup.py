@@ -4,7 +4,8 @@
 import os
 from glob import glob
 
-from setuptools import find_packages, setup
+from setuptools import Extension, find_packages, setup
+from setuptools.command.build_ext import build_ext
 
 # allow setup.py to be run from any path
 os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
@@ -15,14 +16,31 @@ with open("README.md", encoding="utf-8") as f:
 
 # https://stackoverflow.com/questions/46784964/create-package-with-cython-so-users-can-install-it-without-having-cython-already
 try:
-    from Cython.Distutils.extension import Extension
-    from Cython.Distutils import build_ext
+    from Cython.Build import cythonize
 except ImportError:
-    from setuptools import Extension
     USING_CYTHON = False
 else:
     USING_CYTHON = True
 
+# optimisation flags per compiler type; some Python builds default to -O2.
+# Host-specific (-march=native) and IEEE-relaxing (-ffast-math) flags are
+# deliberately left out: wheels must stay portable, and NaN handling must
+# stay exact since NaN marks missing values.
+COMPILE_ARGS = {
+    'unix': ['-O3'],
+    'mingw32': ['-O3'],
+}
+
+
+class BuildExt(build_ext):
+    def build_extensions(self):
+        args = COMPILE_ARGS.get(self.compiler.compiler_type, [])
+        for extension in self.extensions:
+            extension.extra_compile_args = args + list(
+                extension.extra_compile_args or [])
+        super().build_extensions()
+
+
 ext = 'pyx' if USING_CYTHON else 'c'
 sources = glob(f'nmf/*.{ext}')
 extensions = [
@@ -31,7 +49,11 @@ extensions = [
     )
     for source in sources
 ]
-cmdclass = {'build_ext': build_ext} if USING_CYTHON else {}
+if USING_CYTHON:
+    # compiler directives are set in the header of each .pyx file
+    extensions = cythonize(extensions, nthreads=os.cpu_count(),
+                           language_level=3)
+cmdclass = {'build_ext': BuildExt}
 
 
 setup(
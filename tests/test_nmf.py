@@ -23,12 +23,21 @@ from sklearn.exceptions import ConvergenceWarning
 
 from nmf import nmf
 from nmf.nmf import NMF, non_negative_factorization
+from nmf.utils import check_non_negative
 
 
-def test_initialize_nn_output():
-    # Test that initialization does not return negative values
+@pytest.fixture(scope='module')
+def nonneg_data():
+    # Shared read-only non-negative data for tests that do not modify it
     rng = np.random.mtrand.RandomState(42)
     data = np.abs(rng.randn(10, 10))
+    data.flags.writeable = False
+    return data
+
+
+def test_initialize_nn_output(nonneg_data):
+    # Test that initialization does not return negative values
+    data = nonneg_data
     for init in ('random', 'nndsvd', 'nndsvda', 'nndsvdar'):
         W, H = nmf._initialize_nmf(data, 10, init=init, random_state=0)
         assert not ((W < 0).any() or (H < 0).any())
@@ -65,24 +74,36 @@ def test_parameter_checking():
                              3, init)
 
 
-def test_initialize_close():
+def test_check_non_negative_negative_zero():
+    # Test that -0. is not reported as a negative value, for dense and
+    # sparse data, including sparse matrices storing -0. explicitly
+    X = sp.csr_matrix(np.array([[1., 0.], [0., 2.]]))
+    X.data[0] = -0.
+    for fmt in ('csr', 'csc', 'coo', 'lil', 'dok'):
+        check_non_negative(X.asformat(fmt), 'spam')
+    check_non_negative(X.toarray(), 'spam')
+
+    X.data[1] = -2.
+    msg = "Negative values in data passed to spam"
+    assert_raise_message(ValueError, msg, check_non_negative, X, 'spam')
+
+
+def test_initialize_close(nonneg_data):
     # Test NNDSVD error
     # Test that _initialize_nmf error is less than the standard deviation of
     # the entries in the matrix.
-    rng = np.random.mtrand.RandomState(42)
-    A = np.abs(rng.randn(10, 10))
+    A = nonneg_data
     W, H = nmf._initialize_nmf(A, 10, init='nndsvd')
     error = linalg.norm(np.dot(W, H) - A)
     sdev = linalg.norm(A - A.mean())
     assert error <= sdev
 
 
-def test_initialize_variants():
+def test_initialize_variants(nonneg_data):
     # Test NNDSVD variants correctness
     # Test that the variants 'nndsvda' and 'nndsvdar' differ from basic
     # 'nndsvd' only where the basic version has zeros.
-    rng = np.random.mtrand.RandomState(42)
-    data = np.abs(rng.randn(10, 10))
+    data = nonneg_data
     W0, H0 = nmf._initialize_nmf(data, 10, init='nndsvd')
     Wa, Ha = nmf._initialize_nmf(data, 10, init='nndsvda')
     War, Har = nmf._initialize_nmf(data, 10, init='nndsvdar',
@@ -165,12 +186,11 @@ def test_n_components_greater_n_features():
 
 def test_nmf_sparse_input():
     # Test that sparse matrices are accepted as input
-    from scipy.sparse import csc_matrix
-
+    # (CSC input is covered by test_nmf_sparse_transform)
     rng = np.random.mtrand.RandomState(42)
     A = np.abs(rng.randn(10, 10))
     A[:, 2 * np.arange(5)] = 0
-    A_sparse = csc_matrix(A)
+    A_sparse = sp.csr_matrix(A)
 
     for solver in ('cd', 'mu'):
         for init in ('random', 'nndsvdar'):
@@ -254,7 +274,11 @@ def test_non_negative_factorization_checking():
 def _beta_divergence_dense(X, W, H, beta):
     """Compute the beta-divergence of X and W.H for dense array only.
 
-    Used as a reference for testing nmf._beta_divergence.
+    X is expected to be non-negative, possibly with NaN for missing values.
+
+    Used as a reference for testing nmf._beta_divergence. If beta is a
+    sequence, an array with the divergence for each of its values is
+    returned, and W.H and the masks are only computed once.
     """
     if isinstance(X, numbers.Number):
         W = np.array([[W]])
@@ -264,37 +288,63 @@ def _beta_divergence_dense(X, W, H, beta):
     if sp.issparse(X):
         X = X.toarray()
 
-    WH = np.dot(W, H)
-    mask_nan = np.isnan(X)
-
-    if beta == 2:
-        return squared_norm((X - WH)[~mask_nan]) / 2
+    betas = np.atleast_1d(beta).astype(np.float64)
+    res = np.empty(betas.shape)
 
-    np.maximum(WH, 1e-9, out=WH)
-    mask = np.logical_and(X != 0, ~mask_nan)
+    # keep the dtype of W and H, e.g. float32, and only accumulate the sums
+    # in float64
+    WH = np.dot(W, H)
+    mask_valid = np.isnan(X)
+    np.logical_not(mask_valid, out=mask_valid)
+
+    # the Frobenius norm is computed before clipping WH, with the missing
+    # entries left at zero in the difference
+    is_frobenius = betas == 2
+    if np.any(is_frobenius):
+        diff = np.zeros(WH.shape, dtype=np.float64)
+        np.subtract(X, WH, out=diff, where=mask_valid)
+        res[is_frobenius] = squared_norm(diff) / 2
+
+    np.maximum(WH, WH.dtype.type(1e-9), out=WH)
+    # X is non-negative, so X > 0 excludes both its zeros and NaN
+    with np.errstate(invalid='ignore'):
+        mask = X > 0
     WH_Xnonzero = WH[mask]
     X_nonzero = X[mask]
 
-    if beta == 1:
-        res = np.sum(X_nonzero * np.log(X_nonzero / WH_Xnonzero))
-        res += WH[~mask_nan].sum() - X[~mask_nan].sum()
-    elif beta == 0:
-        div = X_nonzero / WH_Xnonzero
-        res = np.sum(div) - X[~mask_nan].size - np.sum(np.log(div))
-    else:
-        res = (X_nonzero ** beta).sum()
-        res += (beta - 1) * (WH[~mask_nan] ** beta).sum()
-        res -= beta * (X_nonzero * (WH_Xnonzero ** (beta - 1))).sum()
-        res /= beta * (beta - 1)
-
+    for i in np.flatnonzero(~is_frobenius):
+        beta_i = float(betas[i])
+        if beta_i == 1:
+            res_i = np.sum(X_nonzero * np.log(X_nonzero / WH_Xnonzero),
+                           dtype=np.float64)
+            # the zeros of X do not contribute to its sum
+            res_i += (np.sum(WH, where=mask_valid, dtype=np.float64) -
+                      X_nonzero.sum(dtype=np.float64))
+        elif beta_i == 0:
+            div = X_nonzero / WH_Xnonzero
+            res_i = (np.sum(div, dtype=np.float64) -
+                     np.count_nonzero(mask_valid) -
+                     np.sum(np.log(div), dtype=np.float64))
+        else:
+            # both terms over the nonzero entries of X share a reduction
+            res_i = np.sum(X_nonzero ** beta_i -
+                           beta_i * X_nonzero * WH_Xnonzero ** (beta_i - 1),
+                           dtype=np.float64)
+            res_i += (beta_i - 1) * np.sum(WH ** beta_i, where=mask_valid,
+                                           dtype=np.float64)
+            res_i /= beta_i * (beta_i - 1)
+        res[i] = res_i
+
+    if np.ndim(beta) == 0:
+        return res[0]
     return res
 
 
 def _compare_beta_divergence_with_ref(X, W, H):
     # Compare _beta_divergence with the reference _beta_divergence_dense
     beta_losses = [0., 0.5, 1., 1.5, 2.]
-    for beta in beta_losses:
-        ref = _beta_divergence_dense(X, W, H, beta)
+    refs = _beta_divergence_dense(X, W, H, beta_losses)
+    for beta, ref in zip(beta_losses, refs):
         loss = nmf._beta_divergence(X, W, H, beta)
         assert_almost_equal(ref, loss, decimal=7)
 
@@ -377,10 +427,16 @@ def test_special_dot_X():
     assert_array_almost_equal(WH_sparse_data, WH_ref[ii, jj], decimal=10)
     assert_array_almost_equal(WH_masked[ii, jj], WH_ref[ii, jj], decimal=10)
 
-    # test that WH_sparse and X_sparse have the same sparse structure
-    assert_array_equal(WH_sparse.indices, X_sparse.indices)
-    assert_array_equal(WH_sparse.indptr, X_sparse.indptr)
-    assert_array_equal(WH_sparse.shape, X_sparse.shape)
+    # test that WH_sparse and X_sparse have the same sparse structure,
+    # including the format, so that their data are aligned
+    for X_fmt in (X_sparse, X_sparse.tocsc()):
+        WH_fmt = nmf._special_dot_X(W, H, X_fmt)
+        assert WH_fmt.format == X_fmt.format
+        assert_array_equal(WH_fmt.indices, X_fmt.indices)
+        assert_array_equal(WH_fmt.indptr, X_fmt.indptr)
+        assert_array_equal(WH_fmt.shape, X_fmt.shape)
+        assert_array_almost_equal(WH_fmt.toarray()[X_fmt.toarray() != 0],
+                                  WH_ref[X_fmt.toarray() != 0], decimal=10)
 
     # test that WH_masked and X_masked have the same mask
     assert_array_equal(WH_masked.mask, X_masked.mask)
@@ -548,9 +604,17 @@ def test_nmf_with_nan():
     assert_raise_message(ValueError, msg, model.transform, X_nan)
 
 
+@pytest.mark.parametrize('use_nan', (False, True))
+@pytest.mark.parametrize('solver', ('cd', 'mu'))
+@pytest.mark.parametrize('beta_loss', (-1.2, 0, 0.2, 1., 2., 2.5))
 @ignore_warnings(category=ConvergenceWarning)
-def test_nmf_decreasing():
+def test_nmf_decreasing(use_nan, solver, beta_loss):
     # test that the objective function is decreasing at each iteration
+    if use_nan and solver != 'mu':
+        pytest.skip("not implemented")
+    if solver != 'mu' and beta_loss != 2:
+        pytest.skip("not implemented")
+
     n_samples = 20
     n_features = 15
     n_components = 10
@@ -560,39 +624,28 @@ def test_nmf_decreasing():
 
     # initialization
     rng = np.random.mtrand.RandomState(42)
-    X_full = rng.randn(n_samples, n_features)
-    np.abs(X_full, X_full)
-
-    # add missing values
-    X_nan = X_full.copy()
-    X_nan[rng.randint(2, size=(n_samples, n_features)) > 0] = np.nan
+    X = rng.randn(n_samples, n_features)
+    np.abs(X, X)
+    W, H = nmf._initialize_nmf(X, n_components, init='random',
+                               random_state=42)
 
-    W0, H0 = nmf._initialize_nmf(X_full, n_components, init='random',
-                                 random_state=42)
+    if use_nan:
+        # add missing values
+        X[rng.randint(2, size=(n_samples, n_features)) > 0] = np.nan
 
-    for X in [X_full, X_nan]:
-        for beta_loss in (-1.2, 0, 0.2, 1., 2., 2.5):
-            for solver in ('cd', 'mu'):
-                if X is X_nan and solver != 'mu':
-                    # not implemented
-                    continue
-                if solver != 'mu' and beta_loss != 2:
-                    # not implemented
-                    continue
-                W, H = W0.copy(), H0.copy()
-                previous_loss = None
-                for _ in range(30):
-                    # one more iteration starting from the previous results
-                    W, H, _ = non_negative_factorization(
-                        X, W, H, beta_loss=beta_loss, init='custom',
-                        n_components=n_components, max_iter=1, alpha=alpha,
-                        solver=solver, tol=tol, l1_ratio=l1_ratio, verbose=0,
-                        regularization='both', random_state=0, update_H=True)
-
-                    loss = nmf._beta_divergence(X, W, H, beta_loss)
-                    if previous_loss is not None:
-                        assert_greater(previous_loss, loss)
-                    previous_loss = loss
+    previous_loss = None
+    for _ in range(30):
+        # one more iteration starting from the previous results
+        W, H, _ = non_negative_factorization(
+            X, W, H, beta_loss=beta_loss, init='custom',
+            n_components=n_components, max_iter=1, alpha=alpha,
+            solver=solver, tol=tol, l1_ratio=l1_ratio, verbose=0,
+            regularization='both', random_state=0, update_H=True)
+
+        loss = nmf._beta_divergence(X, W, H, beta_loss)
+        if previous_loss is not None:
+            assert_greater(previous_loss, loss)
+        previous_loss = loss
 
 
 def test_nmf_check_missing_values():